@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-"""Analyze mask JSON files and compute per-frame statistics.
+"""Analyze masks (masks.npy or legacy per-frame JSON) and compute per-frame statistics.
 
 Outputs `masks/stats.json` with per-frame metrics: black count, diff count,
 best horizontal shift (and overlap fraction), runs per row, and summary.
@@ -10,95 +10,84 @@ import os
 import json
 from pathlib import Path
 import argparse
-from typing import Set, Tuple
-
-
-def load_rle(path: Path) -> Tuple[int, int, Set[int]]:
-    with open(path, 'r') as fh:
-        data = json.load(fh)
-    w = data['w']
-    h = data['h']
-    rows = data['rows']
-    s = set()
-    for y, runs in enumerate(rows):
-        for start, length in runs:
-            for x in range(start, start + length):
-                s.add(y * w + x)
-    return w, h, s
-
-
-def best_horizontal_shift(prev_set: Set[int], cur_set: Set[int], w: int, max_shift: int = 32) -> Tuple[int, int]:
-    # Returns (best_dx, best_overlap)
-    best_dx = 0
-    best_overlap = 0
-    # Precompute prev per-row sets for quick shifting
-    prev_rows = {}
-    for idx in prev_set:
-        y = idx // w
-        x = idx % w
-        prev_rows.setdefault(y, set()).add(x)
-    cur_rows = {}
-    for idx in cur_set:
-        y = idx // w
-        x = idx % w
-        cur_rows.setdefault(y, set()).add(x)
-
-    for dx in range(-max_shift, max_shift + 1):
-        overlap = 0
-        for y, cur_xs in cur_rows.items():
-            prev_xs = prev_rows.get(y)
-            if not prev_xs:
-                continue
-            # shift cur_xs by -dx to align with prev
-            shifted = {x - dx for x in cur_xs if 0 <= x - dx < w}
-            overlap += len(shifted & prev_xs)
-        if overlap > best_overlap:
-            best_overlap = overlap
-            best_dx = dx
-    return best_dx, best_overlap
-
-
-def analyze_masks(masks_dir: str, out_path: str):
-    p = Path(masks_dir)
-    files = sorted(p.glob('frame_*.json'))
-    if not files:
-        print('No mask JSON files found in', masks_dir)
+from typing import List, Tuple
+
+import numpy as np
+
+from rle_utils import load_masks, unpack_mask
+
+# shift search range; row_spectrum and best_horizontal_shift must use the same value
+MAX_SHIFT = 32
+
+
+def frame_bitvec(mask: np.ndarray) -> int:
+    # pixel p = y*w + x is bit (N-1-p) of the int, i.e. rows read MSB-first
+    return int.from_bytes(np.packbits(mask, bitorder='big').tobytes(), 'big')
+
+
+def row_spectrum(mask: np.ndarray, w: int, max_shift: int) -> np.ndarray:
+    # rows are zero-padded by max_shift so the circular correlation never wraps
+    rows = mask.reshape(-1, w).astype(np.float64)
+    return np.fft.rfft(rows, n=w + max_shift, axis=1)
+
+
+def best_horizontal_shift(prev_spec: np.ndarray, cur_spec: np.ndarray, w: int, max_shift: int = MAX_SHIFT) -> Tuple[int, int]:
+    # Returns (best_dx, best_overlap). Takes row spectra from row_spectrum(mask, w, max_shift)
+    # with the same max_shift, not the pack_rows() bitmaps that emit_segments'
+    # best_horizontal_shift of the same name takes.
+    # corr[dx] = sum over rows of sum_x prev[x - dx] * cur[x], negative dx wrapped to the tail
+    corr = np.fft.irfft((np.conj(prev_spec) * cur_spec).sum(axis=0), n=w + max_shift)
+    overlaps = np.rint(np.concatenate((corr[w:], corr[:max_shift + 1]))).astype(np.int64)
+    # argmax keeps the first (most negative) dx on ties, like the old ascending scan
+    i = int(np.argmax(overlaps))
+    if overlaps[i] <= 0:
+        return 0, 0
+    return i - max_shift, int(overlaps[i])
+
+
+def analyze_masks(masks_dir: str, out_path: str, preloaded=None):
+    # preloaded: a load_masks() result, so a driver can share one load across stages
+    w, h, names, masks = preloaded or load_masks(Path(masks_dir))
+    if not names:
+        print('No masks found in', masks_dir)
         return 1
 
     stats = {'frames': [], 'summary': {}}
-    total_black = 0
     total_diff = 0
     shift_matches = 0
-    w = h = None
-    prev_set = None
-
-    for i, fp in enumerate(files, start=1):
-        w_i, h_i, cur_set = load_rle(fp)
-        if w is None:
-            w, h = w_i, h_i
-        black = len(cur_set)
-        frame_stat = {'frame': i, 'file': fp.name, 'black': black}
-        if prev_set is None:
+    prev = None
+    prev_spec = None
+    # popcount of every frame so far, computed once per frame and reused
+    blacks: List[int] = []
+
+    for i, name in enumerate(names, start=1):
+        mask = unpack_mask(masks[i - 1], w)
+        cur = frame_bitvec(mask)
+        black = cur.bit_count()
+        blacks.append(black)
+        cur_spec = row_spectrum(mask, w, MAX_SHIFT)
+        frame_stat = {'frame': i, 'file': name, 'black': black}
+        if prev is None:
             frame_stat.update({'diff': black, 'best_dx': 0, 'best_overlap': 0, 'overlap_frac': 0.0})
         else:
-            diff = len(prev_set ^ cur_set)
-            best_dx, best_overlap = best_horizontal_shift(prev_set, cur_set, w, max_shift=32)
-            overlap_frac = best_overlap / max(1, max(len(prev_set), len(cur_set)))
+            diff = (prev ^ cur).bit_count()
+            best_dx, best_overlap = best_horizontal_shift(prev_spec, cur_spec, w, max_shift=MAX_SHIFT)
+            overlap_frac = best_overlap / max(1, max(blacks[-2], black))
             frame_stat.update({'diff': diff, 'best_dx': best_dx, 'best_overlap': best_overlap, 'overlap_frac': overlap_frac})
             total_diff += diff
             if overlap_frac >= 0.7:
                 shift_matches += 1
 
         stats['frames'].append(frame_stat)
-        total_black += black
-        prev_set = cur_set
+        prev = cur
+        prev_spec = cur_spec
         if i % 200 == 0:
             print(f'Analyzed {i} frames')
 
-    n = len(files)
+    n = len(names)
     stats['summary'] = {
         'count': n,
-        'avg_black': total_black / n,
+        'avg_black': sum(blacks) / n,
         'avg_diff': total_diff / max(1, n-1),
         'shift_match_percent': 100.0 * shift_matches / max(1, n-1),
         'width': w,
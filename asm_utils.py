@@ -0,0 +1,24 @@
+"""Shared ARMLite assembly text helpers for the emitters."""
+from __future__ import annotations
+
+import numpy as np
+
+
+def word_table(label: str, values) -> str:
+    # a labelled .WORD table, formatted with one tolist() and a single join
+    vals = np.asarray(values, dtype=np.int64).tolist()
+    if not vals:
+        return f'{label}:\n'
+    return f'{label}:\n    .WORD ' + '\n    .WORD '.join(map(str, vals)) + '\n'
+
+
+_HEX2 = [f'0x{i:02x}' for i in range(256)]
+
+
+def byte_table(label: str, values, per_line: int = 16) -> str:
+    # a labelled .BYTE table, 16 hex bytes per line
+    vals = np.asarray(values, dtype=np.uint8).tolist()
+    lines = [f'{label}:\n']
+    for i in range(0, len(vals), per_line):
+        lines.append('    .BYTE ' + ','.join([_HEX2[b] for b in vals[i:i+per_line]]) + '\n')
+    return ''.join(lines)
@@ -4,140 +4,213 @@
 Produces per-segment assembly files containing a small runtime loop
 that loads packed bytes and writes pixels at runtime. This keeps the
 ASM small (mostly data) while the decompressor is compact code.
+
+Frame 0 of each segment is stored in full. Later frames are XOR deltas
+against the previous frame, either sparse (only the changed bytes) or,
+when too many bytes change, dense. The runtime XORs each delta into a
+packed canvas and redraws only the pixels whose bits flipped.
 """
 from __future__ import annotations
 
 import argparse
-import json
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import os
-from typing import List
-
-
-def load_rle(path: Path):
-    with open(path, 'r') as fh:
-        data = json.load(fh)
-    w = data['w']
-    h = data['h']
-    s = set()
-    for y, runs in enumerate(data['rows']):
-        for start, length in runs:
-            for x in range(start, start + length):
-                s.add(y * w + x)
-    return w, h, s
-
-
-def pack_frame(bitset: set, w: int, h: int) -> bytearray:
-    total = w * h
-    out = bytearray((total + 7) // 8)
-    for i in range(total):
-        byte_idx = i // 8
-        bit_idx = 7 - (i % 8)  # MSB-first
-        if i in bitset:
-            out[byte_idx] |= (1 << bit_idx)
-    return out
-
-
-def emit_segment_bitpacked(mask_files: List[Path], out_dir: Path, seg_idx: int):
-    frames = []
-    for fp in mask_files:
-        w, h, s = load_rle(fp)
-        frames.append(s)
-    n = len(frames)
-    w = w
-    h = h
+from typing import List, Tuple
+
+import numpy as np
+
+from asm_utils import byte_table, word_table
+from rle_utils import load_masks, unpack_mask
+
+
+def bitvec_from_mask(mask: np.ndarray) -> np.ndarray:
+    # MSB-first: pixel i lands in byte i // 8, bit 7 - (i % 8)
+    return np.packbits(mask, bitorder='big')
+
+
+def pack_frame(mask: np.ndarray, w: int, h: int) -> bytes:
+    # trailing bits of the last byte are zero-padded when w*h % 8 != 0
+    return bitvec_from_mask(mask[:w * h]).tobytes()
+
+
+# delta_count flag for a dense record (signed, so the runtime tests it with BLT)
+DENSE = 0x80000000
+
+
+def delta_words(packed: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # packed: (n, bytes_per_frame) frames. Each frame is XORed with the one
+    # before it (frame 0 with a blank canvas, so it is stored in full).
+    # A sparse frame keeps only its non-zero bytes, as words
+    # (byte_offset << 8) | xor_value; a word costs 4 bytes, so a frame with
+    # more than bytes_per_frame // 4 changed bytes (and frame 0) is stored
+    # densely instead, as bytes_per_frame XOR bytes.
+    # Returns (index, count, words, dense): sparse frame i owns
+    # words[index[i]:index[i]+count[i]]; dense frame i has count[i] == DENSE
+    # and owns dense[index[i]:index[i]+bytes_per_frame].
+    n, bytes_per_frame = packed.shape
+    deltas = packed.copy()
+    deltas[1:] ^= packed[:-1]
+    changed = np.count_nonzero(deltas, axis=1)
+    is_dense = changed > bytes_per_frame // 4
+    is_dense[:1] = True
+    sparse = np.where(is_dense[:, None], 0, deltas)
+    frame_idx, offsets = np.nonzero(sparse)
+    words = (offsets.astype(np.int64) << 8) | sparse[frame_idx, offsets]
+    sparse_count = np.bincount(frame_idx, minlength=n)
+    sparse_index = np.concatenate(([0], np.cumsum(sparse_count)[:-1]))
+    dense_index = (np.cumsum(is_dense) - 1) * bytes_per_frame
+    index = np.where(is_dense, dense_index, sparse_index)
+    count = np.where(is_dense, DENSE, sparse_count)
+    return index, count, words, deltas[is_dense].reshape(-1)
+
+
+def _apply_byte(parts: List[str], tag: str):
+    # R10 = byte offset, R11 = non-zero xor value: update the canvas byte and
+    # redraw only the pixels whose bits flipped, black if set and white if clear.
+    # 8 bits per byte is fixed, so the bit tests (MSB first) are unrolled with
+    # per-bit masks and screen offsets baked in.
+    parts.append('    ADD R9, R10, R2   ; R9 -> canvas byte\n')
+    parts.append('    LDRB R8, [R9]\n')
+    parts.append('    EOR R8, R8, R11\n')
+    parts.append('    STRB R8, [R9]\n')
+    parts.append('    LSL R9, R10, #5   ; byte_index * 8 pixels * 4 bytes\n')
+    parts.append('    ADD R9, R9, R1    ; R9 -> screen address of the byte\'s first pixel\n')
+    for bit in range(8):
+        mask = 0x80 >> bit
+        addr = 'R9'
+        parts.append(f'    AND R4, R11, #{mask}\n')
+        parts.append('    CMP R4, #0\n')
+        parts.append(f'    BEQ {tag}_skip_{bit}\n')
+        if bit:
+            parts.append(f'    ADD R12, R9, #{bit * 4}\n')
+            addr = 'R12'
+        parts.append(f'    AND R4, R8, #{mask}\n')
+        parts.append('    CMP R4, #0\n')
+        parts.append(f'    BEQ {tag}_white_{bit}\n')
+        parts.append(f'    STR R0, [{addr}]\n')
+        parts.append(f'    B {tag}_skip_{bit}\n')
+        parts.append(f'{tag}_white_{bit}:\n')
+        parts.append(f'    STR R3, [{addr}]\n')
+        parts.append(f'{tag}_skip_{bit}:\n')
+
+
+def emit_segment_bitpacked(masks: np.ndarray, w: int, h: int, out_dir: Path, seg_idx: int):
+    # masks: a slice of load_masks() packed frames
+    n = len(masks)
     bytes_per_frame = (w * h + 7) // 8
+    if w % 8 == 0:
+        # rows are whole bytes, so the row-packed frames already are the
+        # MSB-first frame-packed buffers
+        packed = np.ascontiguousarray(masks).reshape(n, -1)
+    else:
+        frames = [unpack_mask(rows, w) for rows in masks]
+        packed = np.stack([np.frombuffer(pack_frame(mask, w, h), dtype=np.uint8) for mask in frames])
+    delta_index, delta_count, delta_data, dense_data = delta_words(packed)
 
     outp = out_dir / f'segment_{seg_idx:03d}_bitpacked.asm'
     os.makedirs(out_dir, exist_ok=True)
-    with open(outp, 'w') as fh:
-        fh.write('; Bitpacked segment emitter\n')
-        fh.write(f'; frames={n} w={w} h={h} bytes_per_frame={bytes_per_frame}\n\n')
-
-        # runtime
-        fh.write('    MOV R0, #0x000000    ; black colour\n')
-        fh.write('    MOV R1, .PixelScreen ; base address for pixel writes\n')
-        fh.write('    MOV R2, frames_data  ; pointer to packed frames\n')
-        fh.write(f'    MOV R3, #{n}         ; frame count\n')
-        fh.write(f'    MOV R4, #{bytes_per_frame} ; bytes/frame\n')
-        fh.write('    MOV R5, #0           ; frame index\n')
-        fh.write('\n')
-        fh.write('frame_loop:\n')
-        # compute data ptr = R2 + R5 * bytes_per_frame
-        # bytes_per_frame typically 1536 = 512 + 1024 -> implement as (R<<9) + (R<<10)
-        fh.write('    MOV R6, R5\n')
-        fh.write('    LSL R6, R6, #9    ; *512\n')
-        fh.write('    MOV R7, R6\n')
-        fh.write('    LSL R7, R7, #1    ; *1024\n')
-        fh.write('    ADD R6, R6, R7    ; *1536 -> frame offset in bytes\n')
-        fh.write('    ADD R6, R6, R2    ; R6 -> ptr to frame data\n')
-
-        fh.write('    MOV R10, #0       ; pixel index counter (counts pixels written)\n')
-        fh.write('    MOV R7, #0        ; byte index\n')
-        fh.write('byte_loop:\n')
-        fh.write('    LDRB R8, [R6]     ; load packed byte\n')
-        fh.write('    CMP R8, #0\n')
-        fh.write('    BEQ byte_skip\n')
-        fh.write('    MOV R9, #0x80    ; bit mask (MSB first)\n')
-        fh.write('bit_loop:\n')
-        fh.write('    AND R11, R8, R9\n')
-        fh.write('    CMP R11, #0\n')
-        fh.write('    BEQ bit_skip\n')
-        fh.write('    LSL R12, R10, #2   ; pixel_index * 4 (word offset)\n')
-        fh.write('    ADD R12, R12, R1   ; address = PixelScreen + offset\n')
-        fh.write('    STR R0, [R12]      ; draw black pixel\n')
-        fh.write('bit_skip:\n')
-        fh.write('    LSR R9, R9, #1\n')
-        fh.write('    ADD R10, R10, #1\n')
-        fh.write('    CMP R9, #0\n')
-        fh.write('    BNE bit_loop\n')
-        fh.write('byte_skip:\n')
-        fh.write('    ADD R6, R6, #1\n')
-        fh.write('    ADD R7, R7, #1\n')
-        fh.write('    CMP R7, R4\n')
-        fh.write('    BLT byte_loop\n')
-
-        fh.write('    ADD R5, R5, #1\n')
-        fh.write('    CMP R5, R3\n')
-        fh.write('    BLT frame_loop\n')
-        fh.write('    HALT\n\n')
-
-        fh.write('.DATA\n')
-        fh.write('frames_data:\n')
-
-        # write packed bytes for all frames
-        for fi, s in enumerate(frames):
-            packed = pack_frame(s, w, h)
-            # write 16 bytes per .BYTE line
-            for i in range(0, len(packed), 16):
-                chunk = packed[i:i+16]
-                fh.write('    .BYTE ')
-                fh.write(','.join(f'0x{b:02x}' for b in chunk))
-                fh.write('\n')
+    parts: List[str] = []
+    parts.append('; Bitpacked segment emitter (XOR deltas)\n')
+    parts.append(f'; frames={n} w={w} h={h} bytes_per_frame={bytes_per_frame} '
+                 f'delta_words={len(delta_data)} dense_bytes={len(dense_data)}\n\n')
+
+    # runtime
+    parts.append('    MOV R0, #0x000000    ; black colour\n')
+    parts.append('    MOV R1, .PixelScreen ; base address for pixel writes\n')
+    parts.append('    MOV R2, canvas       ; packed current frame, rebuilt from deltas\n')
+    parts.append('    MOV R3, #0xFFFFFF    ; white colour\n')
+    parts.append('    MOV R5, #0           ; frame index\n')
+    parts.append('    STR R0, .ClearScreen ; white screen to match the blank canvas\n')
+    parts.append('\n')
+    parts.append('frame_loop:\n')
+    parts.append('    LSL R11, R5, #2   ; frame index * 4\n')
+    parts.append('    MOV R12, delta_index\n')
+    parts.append('    ADD R12, R12, R11\n')
+    parts.append('    LDR R6, [R12]     ; first delta word (or dense byte) of this frame\n')
+    parts.append('    MOV R12, delta_count\n')
+    parts.append('    ADD R12, R12, R11\n')
+    parts.append('    LDR R7, [R12]     ; delta words left, or DENSE (negative)\n')
+    parts.append('    CMP R7, #0\n')
+    parts.append('    BLT dense_frame\n')
+    # sparse frame: canvas[offset] ^= value for each delta word
+    parts.append('    LSL R6, R6, #2\n')
+    parts.append('    MOV R12, delta_data\n')
+    parts.append('    ADD R6, R6, R12   ; R6 -> ptr to delta words\n')
+    parts.append('sparse_loop:\n')
+    parts.append('    CMP R7, #0\n')
+    parts.append('    BEQ frame_done\n')
+    parts.append('    LDR R10, [R6]     ; (byte offset << 8) | xor value\n')
+    parts.append('    AND R11, R10, #0xFF\n')
+    parts.append('    LSR R10, R10, #8\n')
+    _apply_byte(parts, 'sparse')
+    parts.append('    ADD R6, R6, #4\n')
+    parts.append('    SUB R7, R7, #1\n')
+    parts.append('    B sparse_loop\n')
+    # dense frame: canvas[i] ^= dense[i] for every byte, skipping zero bytes
+    parts.append('dense_frame:\n')
+    parts.append('    MOV R12, dense_data\n')
+    parts.append('    ADD R6, R6, R12   ; R6 -> ptr to this frame\'s xor bytes\n')
+    parts.append('    MOV R10, #0       ; byte index\n')
+    parts.append('dense_loop:\n')
+    parts.append('    LDRB R11, [R6]\n')
+    parts.append('    CMP R11, #0\n')
+    parts.append('    BEQ dense_next\n')
+    _apply_byte(parts, 'dense')
+    parts.append('dense_next:\n')
+    parts.append('    ADD R6, R6, #1\n')
+    parts.append('    ADD R10, R10, #1\n')
+    parts.append(f'    CMP R10, #{bytes_per_frame}\n')
+    parts.append('    BLT dense_loop\n')
+
+    parts.append('frame_done:\n')
+    parts.append('    ADD R5, R5, #1\n')
+    parts.append(f'    CMP R5, #{n}\n')
+    parts.append('    BLT frame_loop\n')
+    parts.append('    HALT\n\n')
+
+    parts.append('.DATA\n')
+    parts.append(word_table('delta_index', delta_index))
+    parts.append(word_table('delta_count', delta_count))
+    parts.append(word_table('delta_data', delta_data))
+    parts.append(byte_table('dense_data', dense_data))
+    parts.append('canvas:\n')
+    parts.append(f'    .BLOCK {bytes_per_frame}\n')
+    outp.write_text(''.join(parts))
 
     print('Wrote bitpacked segment:', outp)
 
 
+def emit_bitpacked(masks_dir: str, out_dir: str, segment_size: int = 256, jobs: int = 0, preloaded=None):
+    # preloaded: a load_masks() result, so a driver can share one load across stages
+    w, h, names, masks = preloaded or load_masks(Path(masks_dir))
+    if not names:
+        print('No masks found in', masks_dir)
+        return 1
+    os.makedirs(out_dir, exist_ok=True)
+
+    # segments are independent, so each goes to a worker
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as ex:
+        futures = []
+        for i in range(0, len(names), segment_size):
+            chunk = masks[i:i+segment_size]
+            seg_idx = i // segment_size
+            futures.append(ex.submit(emit_segment_bitpacked, chunk, w, h, Path(out_dir), seg_idx))
+        for fut in futures:
+            fut.result()
+
+    return 0
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--masks-dir', default='masks')
     parser.add_argument('--out-dir', default='segments_bitpacked')
     parser.add_argument('--segment-size', type=int, default=256)
+    parser.add_argument('--jobs', type=int, default=0,
+                        help='Worker processes (0 = one per CPU)')
     args = parser.parse_args()
-
-    p = Path(args.masks_dir)
-    files = sorted(p.glob('frame_*.json'))
-    if not files:
-        print('No masks found in', args.masks_dir)
-        return 1
-    os.makedirs(args.out_dir, exist_ok=True)
-
-    for i in range(0, len(files), args.segment_size):
-        chunk = files[i:i+args.segment_size]
-        seg_idx = i // args.segment_size
-        emit_segment_bitpacked(chunk, Path(args.out_dir), seg_idx)
-
-    return 0
+    return emit_bitpacked(args.masks_dir, args.out_dir, args.segment_size, args.jobs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""Run mask analysis and both emitters in one process.
+
+Usage:
+  python pipeline.py --masks-dir masks --segment-size 256
+
+Masks are loaded once (load_masks) and the packed result is handed to every
+stage, so legacy JSON masks are decoded once instead of once per stage.
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+from analyze_masks import analyze_masks
+from emit_bitpacked import emit_bitpacked
+from emit_segments import emit_segments
+from rle_utils import load_masks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--masks-dir', default='masks')
+    parser.add_argument('--stats-out', default='masks/stats.json')
+    parser.add_argument('--segments-dir', default='segments')
+    parser.add_argument('--bitpacked-dir', default='segments_bitpacked')
+    parser.add_argument('--segment-size', type=int, default=256)
+    parser.add_argument('--base-frac', type=float, default=0.9)
+    parser.add_argument('--jobs', type=int, default=0,
+                        help='Worker processes per emitter (0 = one per CPU)')
+    args = parser.parse_args()
+
+    preloaded = load_masks(Path(args.masks_dir))
+    rc = analyze_masks(args.masks_dir, args.stats_out, preloaded=preloaded)
+    if rc:
+        return rc
+    rc = emit_segments(args.masks_dir, args.segments_dir, args.segment_size, args.base_frac, args.jobs,
+                       preloaded=preloaded)
+    if rc:
+        return rc
+    return emit_bitpacked(args.masks_dir, args.bitpacked_dir, args.segment_size, args.jobs, preloaded=preloaded)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
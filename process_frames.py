@@ -1,19 +1,25 @@
 #!/usr/bin/env python3
-"""Convert frames to 1-bit masks and write compact RLE per-frame.
+"""Convert frames to 1-bit masks for the downstream emitters.
 
 Usage:
   python process_frames.py --frames-dir frames --out-dir masks --subset 200
 
-Outputs per-frame JSON files with RLE rows and a `index.json` summary.
+By default writes a single `masks.npy` holding every frame as a packed
+(n_frames, h, ceil(w/8)) uint8 array (MSB-first rows), plus an `index.json`
+sidecar with the frame size and per-frame metadata. `--format json` keeps
+the legacy per-frame JSON files with RLE rows.
 """
 from __future__ import annotations
 
 import os
 import sys
 import json
+import numpy as np
 from PIL import Image
 from pathlib import Path
 import argparse
+from functools import partial
+from multiprocessing import Pool
 
 
 def frame_paths(frames_dir):
@@ -22,29 +28,40 @@ def frame_paths(frames_dir):
     return files
 
 
-def mask_rle_from_image(path, threshold=128):
+def mask_from_image(path, threshold=128):
     im = Image.open(path).convert('L')
-    w, h = im.size
-    pix = im.load()
-    rows = []
-    total_black = 0
-    for y in range(h):
-        runs = []
-        x = 0
-        while x < w:
-            # find next black pixel
-            while x < w and pix[x, y] >= threshold:
-                x += 1
-            if x >= w:
-                break
-            start = x
-            while x < w and pix[x, y] < threshold:
-                x += 1
-            length = x - start
-            runs.append([start, length])
-            total_black += length
-        rows.append(runs)
-    return {'w': w, 'h': h, 'rows': rows, 'black': total_black}
+    return np.asarray(im, dtype=np.uint8) < threshold
+
+
+def mask_rle_from_image(path, threshold=128):
+    mask = mask_from_image(path, threshold=threshold)
+    h, w = mask.shape
+    # pad each row with a white pixel on both sides so every run has a
+    # rising (+1) and a falling (-1) edge in the row-wise diff
+    padded = np.zeros((h, w + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    ys, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    rows = [[] for _ in range(h)]
+    for y, start, length in zip(ys.tolist(), starts.tolist(), (ends - starts).tolist()):
+        rows[y].append([start, length])
+    return {'w': w, 'h': h, 'rows': rows, 'black': int(mask.sum())}
+
+
+def _process_one(job, threshold=128):
+    # outf is None when frames go to masks.npy; the packed rows are returned instead
+    i, (fp, outf) = job
+    entry = {'src': os.path.basename(fp)}
+    if outf is None:
+        mask = mask_from_image(fp, threshold=threshold)
+        entry['black'] = int(mask.sum())
+        return i, entry, np.packbits(mask, axis=1, bitorder='big')
+    rle = mask_rle_from_image(fp, threshold=threshold)
+    with open(outf, 'w') as fh:
+        json.dump(rle, fh)
+    entry.update({'out': os.path.basename(outf), 'black': rle['black']})
+    return i, entry, None
 
 
 def main():
@@ -54,6 +71,10 @@ def main():
     parser.add_argument('--threshold', type=int, default=128)
     parser.add_argument('--subset', type=int, default=0,
                         help='Process only first N frames (0 = all)')
+    parser.add_argument('--format', choices=('npy', 'json'), default='npy',
+                        help='npy: one packed masks.npy; json: legacy per-frame RLE files')
+    parser.add_argument('--jobs', type=int, default=0,
+                        help='Worker processes (0 = one per CPU)')
     args = parser.parse_args()
 
     frames = frame_paths(args.frames_dir)
@@ -65,16 +86,32 @@ def main():
     if args.subset > 0:
         frames = frames[:args.subset]
 
-    index = {'count': len(frames), 'frames': []}
-
-    for i, fp in enumerate(frames, start=1):
-        outf = os.path.join(args.out_dir, f'frame_{i:05d}.json')
-        rle = mask_rle_from_image(fp, threshold=args.threshold)
-        with open(outf, 'w') as fh:
-            json.dump(rle, fh)
-        index['frames'].append({'src': os.path.basename(fp), 'out': os.path.basename(outf), 'black': rle['black']})
-        if i % 50 == 0:
-            print(f'Processed {i}/{len(frames)}')
+    with Image.open(frames[0]) as im:
+        w, h = im.size
+
+    packed = None
+    if args.format == 'npy':
+        jobs = [(fp, None) for fp in frames]
+        packed = np.lib.format.open_memmap(os.path.join(args.out_dir, 'masks.npy'), mode='w+',
+                                           dtype=np.uint8, shape=(len(frames), h, (w + 7) // 8))
+    else:
+        jobs = [(fp, os.path.join(args.out_dir, f'frame_{i:05d}.json')) for i, fp in enumerate(frames, start=1)]
+    entries = [None] * len(jobs)
+    worker = partial(_process_one, threshold=args.threshold)
+    with Pool(args.jobs or os.cpu_count()) as pool:
+        # frames are independent; results arrive out of order and are slotted back by index
+        for done, (i, entry, bits) in enumerate(pool.imap_unordered(worker, enumerate(jobs), chunksize=8), start=1):
+            entries[i] = entry
+            if packed is not None:
+                if bits.shape != packed.shape[1:]:
+                    raise ValueError(f'{frames[i]}: frame size differs from {frames[0]} ({w}x{h})')
+                packed[i] = bits
+            if done % 50 == 0:
+                print(f'Processed {done}/{len(frames)}')
+    if packed is not None:
+        packed.flush()
+
+    index = {'count': len(frames), 'format': args.format, 'w': w, 'h': h, 'frames': entries}
 
     with open(os.path.join(args.out_dir, 'index.json'), 'w') as fh:
         json.dump(index, fh)
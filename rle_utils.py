@@ -0,0 +1,71 @@
+"""Shared mask loading for the analysis and emitter stages.
+
+Masks come either from a packed `masks.npy` (see process_frames.py) or from
+legacy per-frame RLE JSON files. To share one load across stages, call
+load_masks once and pass the result on (see pipeline.py).
+"""
+from __future__ import annotations
+
+import json
+from itertools import chain
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+
+def load_mask(path: Path) -> Tuple[int, int, np.ndarray]:
+    # Returns (w, h, mask) for one RLE JSON file; mask is a flat uint8 array
+    with open(path, 'r') as fh:
+        data = json.load(fh)
+    w = data['w']
+    h = data['h']
+    rows = data['rows']
+    # flatten every (start, length) pair and mark run edges in one pass:
+    # +1 where a run starts, -1 just past its end; the running sum is the mask
+    runs = np.fromiter(chain.from_iterable(chain.from_iterable(rows)), dtype=np.int64).reshape(-1, 2)
+    ys = np.repeat(np.arange(h), [len(r) for r in rows])
+    starts = ys * w + runs[:, 0]
+    edges = np.zeros(w * h + 1, dtype=np.int8)
+    # runs never overlap, so starts (and ends) are unique and plain fancy
+    # indexing is enough; an end may coincide with the next row's start
+    edges[starts] += 1
+    edges[starts + runs[:, 1]] -= 1
+    mask = np.cumsum(edges[:-1], dtype=np.int8).view(np.uint8)
+    return w, h, mask
+
+
+def load_masks(masks_dir: Path) -> Tuple[int, int, List[str], np.ndarray]:
+    # Returns (w, h, names, packed); packed is (n, h, ceil(w/8)) MSB-first rows,
+    # memory-mapped from masks.npy or rebuilt from per-frame JSON files.
+    # index.json records which format process_frames last wrote, so stale
+    # artefacts of the other format in the same directory are ignored;
+    # index files without 'format' predate masks.npy and mean JSON.
+    index = None
+    index_path = masks_dir / 'index.json'
+    if index_path.exists():
+        with open(index_path, 'r') as fh:
+            index = json.load(fh)
+    if index is not None and index.get('format') == 'npy':
+        npy = masks_dir / 'masks.npy'
+        packed = np.load(npy, mmap_mode='r')
+        names = [f['src'] for f in index['frames']]
+        if len(names) != packed.shape[0]:
+            raise ValueError(f'{npy} holds {packed.shape[0]} frames but {index_path} lists {len(names)}')
+        return index['w'], index['h'], names, packed
+    if index is not None and index.get('format') == 'json':
+        files = [masks_dir / f['out'] for f in index['frames']]
+    else:
+        files = sorted(masks_dir.glob('frame_*.json'))
+    if not files:
+        return 0, 0, [], np.zeros((0, 0, 0), dtype=np.uint8)
+    packed = []
+    for fp in files:
+        w, h, mask = load_mask(fp)
+        packed.append(np.packbits(mask.reshape(h, w), axis=1, bitorder='big'))
+    return w, h, [fp.name for fp in files], np.stack(packed)
+
+
+def unpack_mask(rows: np.ndarray, w: int) -> np.ndarray:
+    # one frame of load_masks() back to a flat uint8 mask of h*w pixels
+    return np.unpackbits(rows, axis=-1, count=w, bitorder='big').reshape(-1)
@@ -30,6 +30,8 @@ from datetime import datetime
 import os
 from typing import Sequence
 
+import numpy as np
+
 # Resolution presets (width, height, .Resolution value)
 RESOLUTIONS = {
     'low': (32, 32, 0),   # 32x32 low-res (direct addressed)
@@ -76,6 +78,10 @@ def generate_truecolor_assembly(
     """
     Generate ARMLite assembly code for a grid of true color values.
 
+    Pixels are run-length encoded in row-major order: the data table holds
+    (run length, color) word pairs and a small loop repeats each color across
+    the screen, so uniform areas cost one pair instead of one word per pixel.
+
     Args:
         color_grid (Sequence[Sequence[int]]): 2D grid of hexadecimal color values.
         output_path (str): Path to save the generated assembly file.
@@ -87,8 +93,15 @@ def generate_truecolor_assembly(
     width = len(color_grid[0]) if height else 0
     _, _, res_value = RESOLUTIONS.get(resolution, RESOLUTIONS['hi'])
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    # Run-length encode the flattened grid: a run starts wherever the color changes
+    pixels = np.asarray(color_grid, dtype=np.int64).reshape(-1)
+    starts = np.flatnonzero(np.diff(pixels, prepend=pixels[:1] - 1)) if pixels.size else pixels
+    run_lengths = np.diff(np.append(starts, pixels.size))
+    run_colors = pixels[starts]
+
     lines = [
-        '; === True Color Sprite ===',
+        '; === True Color Sprite (RLE) ===',
         f'; Generated: {timestamp}',
     ]
     
@@ -98,23 +111,44 @@ def generate_truecolor_assembly(
         lines.append(f'; {comment}')
 
     lines.extend([
-        f'; Resolution: {width}x{height} (mode {res_value})'
+        f'; Resolution: {width}x{height} (mode {res_value})',
+        f'; {width * height} pixels in {len(starts)} runs',
         '; Full 24-bit RGB  - no palette quantization',
         '',
         f'    MOV R0, #{res_value}',
         '    STR R0, .Resolution',
         '    MOV R1, .PixelScreen', 
+        '    MOV R2, #runs',
+        f'    MOV R3, #{len(starts)}',
+        '    MOV R4, #0           ; run index',
+        '    CMP R3, #0',
+        '    BEQ draw_done',
+        '',
+        'run_loop:',
+        '    LDR R6, [R2]         ; run length',
+        '    ADD R2, R2, #4',
+        '    LDR R5, [R2]         ; run color',
+        '    ADD R2, R2, #4',
+        'fill_loop:',
+        '    STR R5, [R1]         ; write color to screen',
+        '    ADD R1, R1, #4       ; next screen pixel',
+        '    SUB R6, R6, #1',
+        '    CMP R6, #0',
+        '    BGT fill_loop',
+        '    ADD R4, R4, #1       ; next run',
+        '    CMP R4, R3',
+        '    BLT run_loop',
+        'draw_done:',
+        '   HALT',
+        '',
+        '.DATA',
+        'runs:',
     ])
 
-    for y in range(height):
-        for x in range(width):
-            offset = ((y * width) + x) * 4
-            hex_color = color_grid[y][x]
-            lines.append(f'    MOV R5, #{offset}')
-            lines.append(f'   ADD R4, R1, R5')
-            lines.append(f'    MOV R0, #0x{hex_color:06X}')
-            lines.append(f'    STR R0, [R4]   ; ({x},{y})')
-    lines.append('   HALT')
+    for length, color in zip(run_lengths.tolist(), run_colors.tolist()):
+        lines.append(f'    .WORD {length}')
+        lines.append(f'    .WORD 0x{color:06X}')
+
     with open(output_path, 'w') as fh:
         fh.write('\n'.join(lines))
 
@@ -0,0 +1,49 @@
+"""Round-trip check for the emit_bitpacked delta tables.
+
+Decodes delta_words() output the way the runtime does (XOR each record into a
+blank canvas) and compares every canvas against the packed frames. Run with pytest.
+"""
+import numpy as np
+import pytest
+
+from emit_bitpacked import DENSE, delta_words
+
+
+def decode(index, count, words, dense, bytes_per_frame):
+    canvas = np.zeros(bytes_per_frame, dtype=np.uint8)
+    frames = []
+    for start, n in zip(index.tolist(), count.tolist()):
+        if n == DENSE:
+            canvas ^= dense[start:start + bytes_per_frame]
+        else:
+            for word in words[start:start + n].tolist():
+                canvas[word >> 8] ^= word & 0xFF
+        frames.append(canvas.copy())
+    return np.stack(frames)
+
+
+def make_frames(n, bytes_per_frame, change, seed):
+    rng = np.random.default_rng(seed)
+    frames = [rng.integers(0, 256, bytes_per_frame, dtype=np.uint8)]
+    for _ in range(n - 1):
+        flip = rng.random(bytes_per_frame) < change
+        frames.append(frames[-1] ^ np.where(flip, rng.integers(1, 256, bytes_per_frame), 0).astype(np.uint8))
+    return np.stack(frames)
+
+
+@pytest.mark.parametrize('bytes_per_frame,change', [(1536, 0.01), (1536, 0.5), (193, 0.2), (7, 0.3)])
+def test_delta_tables_round_trip(bytes_per_frame, change):
+    packed = make_frames(20, bytes_per_frame, change, bytes_per_frame)
+    index, count, words, dense = delta_words(packed)
+    assert count[0] == DENSE
+    np.testing.assert_array_equal(decode(index, count, words, dense, bytes_per_frame), packed)
+
+
+def test_dense_frames_cost_no_more_than_raw():
+    # an all-black keyframe between blank frames: every byte changes twice
+    packed = np.zeros((4, 1536), dtype=np.uint8)
+    packed[1] = 0xFF
+    index, count, words, dense = delta_words(packed)
+    assert len(words) == 0
+    assert len(dense) == 3 * 1536
+    np.testing.assert_array_equal(decode(index, count, words, dense, 1536), packed)
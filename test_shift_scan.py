@@ -0,0 +1,54 @@
+"""Regression check that every best_horizontal_shift agrees with a per-pixel scan.
+
+emit_segments has a Numba kernel and a NumPy fallback over pack_rows() bitmaps;
+analyze_masks has an FFT version over row_spectrum() spectra. Run with pytest.
+"""
+import numpy as np
+import pytest
+
+import analyze_masks
+import emit_segments
+
+CASES = [(13, 5, 4), (64, 6, 64), (70, 4, 70), (130, 3, 100), (200, 2, 64)]
+
+
+def naive_shift(prev: np.ndarray, cur: np.ndarray, max_shift: int):
+    # overlap(dx) = sum over pixels of prev[y, x] & cur[y, x + dx]; first best dx wins
+    h, w = prev.shape
+    best_dx, best_overlap = 0, 0
+    for dx in range(-max_shift, max_shift + 1):
+        overlap = 0
+        for y in range(h):
+            for x in range(w):
+                if 0 <= x + dx < w and prev[y, x] and cur[y, x + dx]:
+                    overlap += 1
+        if overlap > best_overlap:
+            best_dx, best_overlap = dx, overlap
+    return best_dx, best_overlap
+
+
+def frame_pairs(w: int, h: int):
+    rng = np.random.default_rng(w * 1000 + h)
+    for density in (0.0, 0.05, 0.5, 1.0):
+        prev = (rng.random((h, w)) < density).astype(np.uint8)
+        yield prev, (rng.random((h, w)) < density).astype(np.uint8)
+        # a shifted copy, so the best dx is not just noise
+        yield prev, np.roll(prev, int(rng.integers(-w, w)), axis=1)
+
+
+@pytest.mark.parametrize('w,h,max_shift', CASES)
+def test_shift_implementations_match_naive(w, h, max_shift, monkeypatch):
+    for prev, cur in frame_pairs(w, h):
+        expected = naive_shift(prev, cur, max_shift)
+
+        prev_bits = emit_segments.pack_rows(prev.reshape(-1), w)
+        cur_bits = emit_segments.pack_rows(cur.reshape(-1), w)
+        if emit_segments._scan_shifts is not None:
+            assert emit_segments.best_horizontal_shift(prev_bits, cur_bits, w, max_shift) == expected
+        with monkeypatch.context() as m:
+            m.setattr(emit_segments, '_scan_shifts', None)
+            assert emit_segments.best_horizontal_shift(prev_bits, cur_bits, w, max_shift) == expected
+
+        prev_spec = analyze_masks.row_spectrum(prev.reshape(-1), w, max_shift)
+        cur_spec = analyze_masks.row_spectrum(cur.reshape(-1), w, max_shift)
+        assert analyze_masks.best_horizontal_shift(prev_spec, cur_spec, w, max_shift) == expected